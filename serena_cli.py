@@ -1,212 +1,933 @@
 
 import argparse
-import asyncio
+import builtins
+import contextlib
+import functools
 import json
 import sys
 import os
-from contextlib import AsyncExitStack
-from typing import Optional, Any, Dict, List
+import itertools
+import stat
+from typing import Optional, Any, Dict, Iterable, Iterator, List, Tuple
+
+# asyncio and the mcp client stack are imported where they are used, so that
+# --help and argument errors do not pay for loading them.
+
+try:
+    import orjson
+except ImportError:
+    # Optional speedup; fall back to the stdlib encoder/decoder
+    orjson = None
+
+if orjson is not None:
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch one type
+    json_loads = orjson.loads
+
+    def json_dumpb(obj, pretty: bool = False) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0)
+else:
+    json_loads = json.loads
+
+    def json_dumpb(obj, pretty: bool = False) -> bytes:
+        if pretty:
+            return json.dumps(obj, indent=2).encode()
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+def stdout_bytes_writer():
+    """Return a write function for already-encoded output that bypasses the text layer's encoder when possible."""
+    buffer = getattr(sys.stdout, 'buffer', None)
+    if buffer is None:
+        return lambda data: sys.stdout.write(data.decode())
+    # Flush pending text first so output stays in order
+    sys.stdout.flush()
+    return buffer.write
+
+DEFAULT_SERVER_URL = "http://localhost:8000/sse"
+DEFAULT_MAX_CONCURRENCY = 8
+OUTPUT_FORMATS = ('text', 'json', 'jsonl')
+
+# Prefer the per-user runtime directory (tmpfs, private to the user) when there is one
+if os.environ.get("XDG_RUNTIME_DIR"):
+    DEFAULT_DAEMON_SOCKET = os.path.join(os.environ["XDG_RUNTIME_DIR"], "serena-cli.sock")
+else:
+    DEFAULT_DAEMON_SOCKET = "~/.cache/serena-mcp.sock"
+
+@functools.lru_cache(maxsize=None)
+def load_ijson():
+    """Import ijson on first use; returns None when it is not installed."""
+    try:
+        import ijson
+    except ImportError:
+        # Optional; without it a limited query decodes the whole response
+        return None
+    return ijson
 
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
-from mcp.client.sse import sse_client
+def open_transport(args: argparse.Namespace):
+    from mcp import StdioServerParameters
+    from mcp.client.stdio import stdio_client
+    from mcp.client.sse import sse_client
 
-async def run_query(args: argparse.Namespace):
     # Determine transport
-    exit_stack = AsyncExitStack()
+    if args.server_command:
+        # Stdio transport
+        server_params = StdioServerParameters(
+            command=args.server_command,
+            args=args.server_args,
+            # None: mcp passes the server only its small whitelist of safe
+            # variables (PATH, HOME, ...), so no full copy of os.environ is made
+            env=None
+        )
+        return stdio_client(server_params)
+    # SSE transport
+    return sse_client(url=args.server_url)
+
+class SerenaSession:
+    """An initialized MCP session over the transport selected by the CLI args.
+
+    Use as ``async with SerenaSession(args) as serena:`` or call ``connect()`` and
+    ``close()`` explicitly; either way both must run in the same task.
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.session = None
+        self._transport = None
+        self._client = None
+
+    async def connect(self) -> "SerenaSession":
+        from mcp import ClientSession
+
+        self._transport = open_transport(self.args)
+        try:
+            read_stream, write_stream = await self._transport.__aenter__()
+        except Exception as e:
+            # uvloop's subprocess_exec leaves out the name of the missing command
+            error = unwrap_error(e)
+            if isinstance(error, FileNotFoundError) and not error.filename and self.args.server_command:
+                error.filename = self.args.server_command
+            raise
+        try:
+            self._client = ClientSession(read_stream, write_stream)
+            self.session = await self._client.__aenter__()
+            await self.session.initialize()
+        except BaseException:
+            await self.close(*sys.exc_info())
+            raise
+        return self
+
+    async def close(self, exc_type=None, exc=None, tb=None):
+        client, transport = self._client, self._transport
+        self.session = self._client = self._transport = None
+        try:
+            if client is not None:
+                await client.__aexit__(exc_type, exc, tb)
+        finally:
+            if transport is not None:
+                await transport.__aexit__(exc_type, exc, tb)
+
+    async def call(self, tool_name: str, tool_args: Dict[str, Any]):
+        return await self.session.call_tool(tool_name, arguments=tool_args)
+
+    async def __aenter__(self) -> "SerenaSession":
+        return await self.connect()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close(exc_type, exc, tb)
+
+def server_config(args: argparse.Namespace) -> Dict[str, Any]:
+    """The server a session connects to, as the daemon reports it to clients."""
+    if args.server_command:
+        return {"command": args.server_command, "args": args.server_args}
+    return {"url": args.server_url}
+
+def requested_server(args: argparse.Namespace) -> Optional[Dict[str, Any]]:
+    """The server the user asked for, or None when no server option was given and any daemon will do."""
+    if args.server_command is None and not args.server_args and args.server_url == DEFAULT_SERVER_URL:
+        return None
+    return server_config(args)
+
+def build_tool_calls(args: argparse.Namespace) -> List[Tuple[str, Dict[str, Any]]]:
+    """Map a query subcommand to the Serena tool calls it needs, as (tool name, arguments) pairs."""
+    if args.subcommand == 'find-symbol':
+        tool_name = "find_symbol"
+        tool_args = {
+            "relative_path": args.path if args.path else "",
+            "max_answer_chars": -1 # We handle limit client-side
+            # "include_kinds": [],
+            # "exclude_kinds": [],
+        }
+        # Handle language hint? The tool doesn't seem to take language hint directly.
+        # "language" is not a param in FindSymbolTool.apply.
+        # We will ignore it for now.
+
+        # One call per requested name; they share the session and run concurrently.
+        return [(tool_name, {**tool_args, "name_path_pattern": name}) for name in args.name]
+
+    elif args.subcommand == 'file-overview':
+        tool_name = "get_symbols_overview"
+        tool_args = {
+            "relative_path": args.path,
+            # "max_answer_chars": -1
+        }
+
+    elif args.subcommand == 'references':
+        tool_name = "find_referencing_symbols"
+        # User prompt: "--name and --path, or Some stable symbol identifier"
+        # Tool definition: name_path, relative_path
+
+        tool_args = {
+            "name_path": args.name,
+            "relative_path": args.path,
+            # "include_kinds": [],
+            # "exclude_kinds": [],
+            "max_answer_chars": -1
+        }
+
+    else:
+        raise ValueError(f"Unknown subcommand: {args.subcommand}")
+
+    return [(tool_name, tool_args)]
+
+def unwrap_error(e: BaseException) -> BaseException:
+    """Return the error inside a chain of single-member exception groups."""
+    # The mcp transports run in anyio task groups, and batches in an asyncio
+    # TaskGroup; both wrap the underlying error
+    while isinstance(e, getattr(builtins, "BaseExceptionGroup", ())) and len(e.exceptions) == 1:
+        e = e.exceptions[0]
+    return e
+
+def describe_error(e: BaseException) -> str:
+    """One-line message for an error, spelling out the failures a query is expected to hit."""
+    e = unwrap_error(e)
+    if isinstance(e, FileNotFoundError) and e.filename:
+        return f"No such file or command: {e.filename}"
+    if isinstance(e, ConnectionError):
+        return f"Lost connection to the server: {e}"
+    if isinstance(e, TimeoutError):
+        return "Timed out waiting for the server"
+    if isinstance(e, json.JSONDecodeError):
+        return f"Malformed JSON: {e}"
+    return str(e) or type(e).__name__
+
+def report_error(e: BaseException):
+    print(f"Error: {describe_error(e)}", file=sys.stderr)
+    # Formatting a traceback is comparatively expensive; only do it when asked to
+    if os.environ.get("SERENA_DEBUG"):
+        import traceback
+        traceback.print_exc()
 
+def query_limit(args: argparse.Namespace) -> Optional[int]:
+    # Apply limit if applicable (only for find-symbol which returns a list)
+    if args.subcommand == 'find-symbol' and args.limit and args.limit > 0:
+        return args.limit
+    return None
+
+# Fields a batch entry must provide, per subcommand
+BATCH_REQUIRED_FIELDS = {
+    'find-symbol': ('name',),
+    'file-overview': ('path',),
+    'references': ('name', 'path'),
+}
+
+def parse_batch(text: str) -> List[Any]:
+    """Split batch input (a JSON array or JSON Lines) into entries.
+
+    A JSON-Lines entry that fails to decode is kept as its exception, so it can be
+    reported in its place without stopping the rest of the batch.
+    """
+    if text.lstrip().startswith('['):
+        entries = json_loads(text)
+        if type(entries) is not list:
+            raise ValueError("batch input must be a JSON array or JSON Lines")
+        return entries
+
+    entries = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            entries.append(json_loads(line))
+        except json.JSONDecodeError as e:
+            entries.append(e)
+    return entries
+
+def batch_entry_calls(entry: Any) -> Tuple[List[Tuple[str, Dict[str, Any]]], Optional[int]]:
+    """Resolve one batch entry into its tool calls and result limit.
+
+    An entry is either a query, e.g. ``{"subcommand": "find-symbol", "name": "Foo"}``,
+    or a raw tool call, e.g. ``{"tool": "find_symbol", "arguments": {...}}``.
+    """
+    if isinstance(entry, Exception):
+        raise entry
+    if not isinstance(entry, dict) or not ('subcommand' in entry or 'tool' in entry):
+        raise ValueError("batch entry must be a JSON object with a 'subcommand' or a 'tool'")
+
+    limit = entry.get('limit')
+    if limit is not None and (type(limit) is not int or limit <= 0):
+        raise ValueError("batch entry 'limit' must be a positive integer")
+
+    if 'tool' in entry:
+        return [(entry['tool'], entry.get('arguments') or {})], limit
+
+    missing = [f for f in BATCH_REQUIRED_FIELDS.get(entry['subcommand'], ()) if not entry.get(f)]
+    if missing:
+        raise ValueError(f"{entry['subcommand']} entry is missing: {', '.join(missing)}")
+
+    args = argparse.Namespace(name=None, path=None, limit=None)
+    vars(args).update(entry)
+    if args.subcommand == 'find-symbol' and isinstance(args.name, str):
+        args.name = [args.name]
+    return build_tool_calls(args), query_limit(args)
+
+def iter_results(result, limit: Optional[int] = None) -> Iterator[Any]:
+    """Decode the JSON text blocks of a tool result, yielding one flat stream of items.
+
+    A block that is not valid JSON contributes no items. With a ``limit`` and ijson
+    installed, list responses are parsed incrementally and parsing stops once
+    ``limit`` items have been read, so a malformed tail past them goes undetected.
+    """
+    ijson = load_ijson() if limit is not None else None
+    decode_errors = (json.JSONDecodeError, ijson.JSONError) if ijson is not None else json.JSONDecodeError
+    remaining = limit
+
+    for content in result.content:
+        if remaining is not None and remaining <= 0:
+            return
+        if content.type != 'text':
+            continue
+        try:
+            if ijson is not None and content.text.lstrip().startswith('['):
+                # Collect before yielding, so a block that breaks off early is dropped whole
+                items = list(itertools.islice(ijson.items(content.text, 'item', use_float=True), remaining))
+            else:
+                # The tools return a JSON string. We need to parse it.
+                data = json_loads(content.text)
+                # Lists (the usual case) are flattened; anything else, e.g. the
+                # {file: [matches]} dict SearchForPattern returns, is kept as one item.
+                items = data if type(data) is list else (data,)
+                if remaining is not None:
+                    items = items[:remaining]
+        except decode_errors:
+             # Not JSON, ignore or handle?
+             continue
+        if remaining is not None:
+            remaining -= len(items)
+        yield from items
+
+def collect_results(result, limit: Optional[int] = None) -> List[Any]:
+    return list(iter_results(result, limit))
+
+def raw_json_list(result) -> Optional[str]:
+    """Return the response text when it is a single well-formed JSON list that can be emitted as-is."""
+    if len(result.content) != 1:
+        return None
+    content = result.content[0]
+    if content.type != 'text' or not content.text.lstrip().startswith('['):
+        return None
+    # Decoding is still needed to tell a JSON list from text such as "[Error] ...";
+    # what the pass-through saves is re-encoding every item.
     try:
-        if args.server_command:
-            # Stdio transport
-            server_params = StdioServerParameters(
-                command=args.server_command,
-                args=args.server_args,
-                env=None # Inherit env?
-            )
-            # We need to handle the async context manager manually or use exit_stack
-            read_stream, write_stream = await exit_stack.enter_async_context(stdio_client(server_params))
-        else:
-            # SSE transport
-            read_stream, write_stream = await exit_stack.enter_async_context(sse_client(url=args.server_url))
+        data = json_loads(content.text)
+    except json.JSONDecodeError:
+        return None
+    if type(data) is not list:
+        return None
+    return content.text.strip()
 
-        session = await exit_stack.enter_async_context(ClientSession(read_stream, write_stream))
-        await session.initialize()
+async def gather_limited(aws: List[Any], max_concurrency: int = 0) -> List[Any]:
+    """Await all of ``aws`` concurrently, at most ``max_concurrency`` at a time (0 = unbounded)."""
+    import asyncio
 
-        # Execute the requested tool
-        result = None
+    if max_concurrency <= 0 or len(aws) <= max_concurrency:
+        return await asyncio.gather(*aws)
 
-        if args.subcommand == 'find-symbol':
-            tool_name = "find_symbol"
-            tool_args = {
-                "name_path_pattern": args.name,
-                "relative_path": args.path if args.path else "",
-                "max_answer_chars": -1 # We handle limit client-side
-                # "include_kinds": [],
-                # "exclude_kinds": [],
-            }
-            # Handle language hint? The tool doesn't seem to take language hint directly.
-            # "language" is not a param in FindSymbolTool.apply.
-            # We will ignore it for now.
-
-            result = await session.call_tool(tool_name, arguments=tool_args)
-
-        elif args.subcommand == 'file-overview':
-            tool_name = "get_symbols_overview"
-            tool_args = {
-                "relative_path": args.path,
-                # "max_answer_chars": -1
-            }
-            result = await session.call_tool(tool_name, arguments=tool_args)
-
-        elif args.subcommand == 'references':
-            tool_name = "find_referencing_symbols"
-            # User prompt: "--name and --path, or Some stable symbol identifier"
-            # Tool definition: name_path, relative_path
-
-            tool_args = {
-                "name_path": args.name,
-                "relative_path": args.path,
-                # "include_kinds": [],
-                # "exclude_kinds": [],
-                "max_answer_chars": -1
-            }
-            result = await session.call_tool(tool_name, arguments=tool_args)
+    semaphore = asyncio.Semaphore(max_concurrency)
 
-        else:
-            print(f"Unknown subcommand: {args.subcommand}", file=sys.stderr)
-            return
+    async def limited(aw):
+        async with semaphore:
+            return await aw
 
-        # Process Output
-        final_data = []
+    return await asyncio.gather(*(limited(aw) for aw in aws))
 
-        for content in result.content:
-            if content.type == 'text':
-                try:
-                    # The tools return a JSON string. We need to parse it.
-                    data = json.loads(content.text)
-                    if isinstance(data, list):
-                        final_data.extend(data)
-                    elif isinstance(data, dict):
-                         # SearchForPattern returns dict {file: [matches]}
-                         # But the query commands we support return list usually.
-                         # If it's a dict, treat as single item or special case?
-                         # For now, append it.
-                         final_data.append(data)
-                    else:
-                        final_data.append(data)
-                except json.JSONDecodeError:
-                     # Not JSON, ignore or handle?
-                     pass
+def is_socket(path: str) -> bool:
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except OSError:
+        return False
+
+async def daemon_listening(socket_path: str) -> bool:
+    import asyncio
+
+    try:
+        _, writer = await asyncio.open_unix_connection(socket_path)
+    except (OSError, AttributeError):
+        return False
+    # An empty request is treated as a liveness probe by the daemon
+    writer.close()
+    await writer.wait_closed()
+    return True
+
+async def daemon_server(socket_path: str) -> Optional[Dict[str, Any]]:
+    """Ask a running daemon which server it is connected to. Returns None if no daemon answers."""
+    import asyncio
+
+    try:
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+    except (OSError, AttributeError):
+        return None
+
+    try:
+        # A request without a "tool" only asks for the daemon's server config
+        writer.write(b"{}\n")
+        await writer.drain()
+        line = await reader.read()
+    except ConnectionError:
+        return None
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+    if not line:
+        return None
+    return json_loads(line).get("server")
+
+async def query_daemon(socket_path: str, tool_name: str, tool_args: Dict[str, Any], limit: Optional[int] = None,
+                       server: Optional[Dict[str, Any]] = None) -> Optional[List[Any]]:
+    """Send one tool call to a running daemon.
+
+    Returns None if no daemon is listening, or if ``server`` is given and the daemon
+    is connected to a different one.
+    """
+    import asyncio
+
+    try:
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+    except (OSError, AttributeError):
+        # No daemon running (or no Unix socket support on this platform)
+        return None
+
+    try:
+        request = {"tool": tool_name, "arguments": tool_args, "limit": limit, "server": server}
+        writer.writelines((json_dumpb(request), b"\n"))
+        await writer.drain()
+        # One reply per connection, so read to EOF: readline() would be capped at
+        # the stream's 64 KiB limit, which a large result easily exceeds
+        line = await reader.read()
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+    if not line:
+        raise ConnectionError("Daemon closed the connection without replying")
+    reply = json_loads(line)
+    if server is not None and reply.get("server") != server:
+        return None
+    if "error" in reply:
+        raise RuntimeError(reply["error"])
+    return reply["results"]
+
+async def run_query(args: argparse.Namespace) -> int:
+    try:
+        tool_calls = build_tool_calls(args)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+
+    max_concurrency = args.max_concurrency if args.subcommand == 'find-symbol' else 0
+    limit = query_limit(args)
+
+    try:
+        results = None
+        if not args.no_daemon:
+            socket_path = os.path.expanduser(args.daemon_socket)
+            server = requested_server(args)
+            results = await gather_limited(
+                [query_daemon(socket_path, tool_name, tool_args, limit, server) for tool_name, tool_args in tool_calls],
+                max_concurrency,
+            )
+            if any(r is None for r in results):
+                results = None
+
+        result = None
+        if results is None:
+            async with SerenaSession(args) as serena:
+                if len(tool_calls) == 1:
+                    # Keep the raw result; it is decoded lazily while being written out
+                    result = await serena.call(*tool_calls[0])
+                else:
+                    async def call(tool_name, tool_args):
+                        return collect_results(await serena.call(tool_name, tool_args), limit)
+
+                    results = await gather_limited(
+                        [call(tool_name, tool_args) for tool_name, tool_args in tool_calls],
+                        max_concurrency,
+                    )
+
+        if result is not None and args.format == 'json' and not pretty_output(args) and limit is None:
+            raw = raw_json_list(result)
+            if raw is not None:
+                # Nothing to slice or merge: the server's JSON list can be framed
+                # without decoding and re-encoding it.
+                sys.stdout.write('{"results":')
+                sys.stdout.write(raw)
+                sys.stdout.write('}\n')
+                return 0
+
+        if result is not None:
+            items = iter_results(result, limit)
+        else:
+            items = itertools.chain.from_iterable(results)
+        if limit is not None:
+            items = itertools.islice(items, limit)
+        write_results(args, items)
+        return 0
+
+    except BrokenPipeError:
+        # The reader went away (e.g. `| head`); there is nobody left to tell
+        return 1
+    except Exception as e:
+        report_error(e)
+        return 1
 
-        # Apply limit if applicable (only for find-symbol which returns a list)
-        if args.subcommand == 'find-symbol' and args.limit and args.limit > 0:
-            final_data = final_data[:args.limit]
+async def run_batch(args: argparse.Namespace) -> int:
+    """Run every entry of a batch over one session, printing one JSON line per entry in input order."""
+    import asyncio
 
-        if args.format == 'json':
-            print(json.dumps({"results": final_data}, indent=2))
+    try:
+        if args.file == '-':
+            text = sys.stdin.read()
+        else:
+            with open(args.file, encoding='utf-8') as f:
+                text = f.read()
+        entries = parse_batch(text)
+    except (OSError, ValueError) as e:
+        report_error(e)
+        return 1
+
+    async def process(call):
+        # Shared by all entries, so --max-concurrency bounds the batch as a whole
+        slots = asyncio.Semaphore(args.max_concurrency) if args.max_concurrency > 0 else contextlib.nullcontext()
+
+        async def run_entry(entry):
+            try:
+                tool_calls, limit = batch_entry_calls(entry)
+                async with slots:
+                    results = await asyncio.gather(*(call(n, a, limit) for n, a in tool_calls))
+                final_data = [item for data in results for item in data]
+                if limit is not None:
+                    del final_data[limit:]
+                return {"results": final_data}
+            except Exception as e:
+                return {"error": str(e)}
+
+        # Entries run concurrently; each line is written as soon as it and all
+        # earlier entries are done, so output order matches input order. If
+        # writing fails (e.g. the reader went away) the remaining entries are cancelled.
+        write = stdout_bytes_writer()
+
+        async def emit(tasks):
+            for task in tasks:
+                write(json_dumpb(await task))
+                write(b"\n")
+
+        if hasattr(asyncio, "TaskGroup"):
+            async with asyncio.TaskGroup() as tg:
+                await emit([tg.create_task(run_entry(entry)) for entry in entries])
         else:
-            format_plain_text(args.subcommand, final_data)
+            tasks = [asyncio.ensure_future(run_entry(entry)) for entry in entries]
+            try:
+                await emit(tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    try:
+        socket_path = os.path.expanduser(args.daemon_socket)
+        server = requested_server(args)
+        daemon = None if args.no_daemon else await daemon_server(socket_path)
+        if daemon is not None and (server is None or daemon == server):
+            async def call(tool_name, tool_args, limit):
+                results = await query_daemon(socket_path, tool_name, tool_args, limit, server)
+                if results is None:
+                    # It answered the probe above, so it has exited or been replaced since
+                    raise ConnectionError("daemon went away")
+                return results
+
+            await process(call)
+            return 0
+
+        async with SerenaSession(args) as serena:
+            async def call(tool_name, tool_args, limit):
+                result = await serena.call(tool_name, tool_args)
+                # Decode in a worker thread so the loop keeps reading other responses
+                return await asyncio.to_thread(collect_results, result, limit)
+
+            await process(call)
+        return 0
 
     except Exception as e:
-        print(f"Error: {e}", file=sys.stderr)
-        import traceback
-        traceback.print_exc()
-    finally:
-        await exit_stack.aclose()
+        if isinstance(unwrap_error(e), BrokenPipeError):
+            # stdout closed (e.g. `| head`); the failed write comes out of the TaskGroup wrapped
+            return 1
+        report_error(e)
+        return 1
+
+async def run_daemon(args: argparse.Namespace) -> int:
+    """Keep one ClientSession alive and serve tool calls over a Unix domain socket.
+
+    Protocol: the client sends one JSON line
+    ``{"tool": ..., "arguments": {...}, "limit": N | null, "server": {...} | null}``
+    and receives one JSON line ``{"results": [...]}`` or ``{"error": "..."}``. Every reply also
+    carries ``"server"``, the daemon's server config. A request without a ``"tool"``, or whose
+    ``"server"`` names a different one, gets only that, so the client can connect directly.
+    """
+    import asyncio
+
+    if not hasattr(asyncio, "start_unix_server"):
+        print("Error: daemon mode requires Unix domain socket support", file=sys.stderr)
+        return 1
+
+    # Unlike --server-args, the trailing command line may hold options of its own
+    command = args.server[1:] if args.server[:1] == ['--'] else args.server
+    if command:
+        args.server_command, args.server_args = command[0], command[1:]
+
+    socket_path = os.path.expanduser(args.daemon_socket)
+    idle_timeout = args.idle_timeout * 60
+    server_info = server_config(args)
+
+    # Refuse to steal the socket from a live daemon, but clean up a stale one.
+    # Anything at that path that is not a socket is left alone.
+    if os.path.lexists(socket_path):
+        if not is_socket(socket_path):
+            print(f"Error: {socket_path} exists and is not a socket", file=sys.stderr)
+            return 1
+        if await daemon_listening(socket_path):
+            print(f"Error: a daemon is already listening on {socket_path}", file=sys.stderr)
+            return 1
+        os.unlink(socket_path)
+    os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+
+    serena = SerenaSession(args)
+    try:
+        await serena.connect()
+    except Exception as e:
+        report_error(e)
+        return 1
+
+    try:
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        idle_handle = None
+        active = 0
+
+        def arm_idle_timer():
+            nonlocal idle_handle
+            if idle_timeout > 0:
+                idle_handle = loop.call_later(idle_timeout, stop.set)
+
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            nonlocal active
+            active += 1
+            if idle_handle is not None:
+                idle_handle.cancel()
+            try:
+                line = await reader.readline()
+                if not line:
+                    # Liveness probe or client gave up before sending a request
+                    return
+                try:
+                    request = json_loads(line)
+                    if "tool" not in request or request.get("server") not in (None, server_info):
+                        # Config query, or a client that wants another server: run nothing
+                        reply = {}
+                    else:
+                        result = await serena.call(request["tool"], request["arguments"])
+                        reply = {"results": collect_results(result, request.get("limit"))}
+                except Exception as e:
+                    reply = {"error": str(e)}
+                reply["server"] = server_info
+                # Hand the encoded reply and its terminator over separately rather
+                # than concatenating them here. Transports with a native writelines
+                # (uvloop, asyncio from 3.12) then send both without copying; the
+                # selector transport of 3.11 and older still joins them.
+                writer.writelines((json_dumpb(reply), b"\n"))
+                await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+                active -= 1
+                if not active:
+                    arm_idle_timer()
+
+        async def keepalive():
+            # Ping on a fixed schedule from its own task, rather than timing out
+            # reads, so an idle connection is kept open without raising anything.
+            while True:
+                await asyncio.sleep(args.keepalive)
+                try:
+                    await serena.session.send_ping()
+                except Exception as e:
+                    # The session is gone; nothing left to serve
+                    report_error(e)
+                    stop.set()
+                    return
+
+        server = await asyncio.start_unix_server(handle, path=socket_path)
+        print(f"Serena daemon listening on {socket_path}", file=sys.stderr)
+        arm_idle_timer()
+        keepalive_task = asyncio.create_task(keepalive()) if args.keepalive > 0 else None
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            if keepalive_task is not None:
+                keepalive_task.cancel()
+            if is_socket(socket_path):
+                os.unlink(socket_path)
+    except BaseException:
+        await serena.close(*sys.exc_info())
+        raise
+    await serena.close()
+    return 0
+
+# Where a result's start line may live, in order of preference
+LINE_PATHS = (
+    ('body_location', 'start_line'),
+    ('selection_range', 'start', 'line'),
+    ('range', 'start', 'line'),
+)
+
+def extract_line(sym: Dict[str, Any]):
+    for path in LINE_PATHS:
+        cur = sym
+        for key in path:
+            cur = cur.get(key) if isinstance(cur, dict) else None
+            if cur is None:
+                break
+        if cur is not None:
+            return cur
+    return '?'
+
+def pretty_output(args: argparse.Namespace) -> bool:
+    # Indent for people reading a terminal; keep piped output compact
+    if args.pretty is None:
+        return sys.stdout.isatty()
+    return args.pretty
+
+def write_results(args: argparse.Namespace, items: Iterable[Any]):
+    """Write query results in the requested format, consuming ``items`` as they are decoded."""
+    if args.format == 'text':
+        format_plain_text(args.subcommand, items)
+        return
+
+    write = stdout_bytes_writer()
+    if args.format == 'jsonl':
+        for item in items:
+            write(json_dumpb(item))
+            write(b"\n")
+    elif pretty_output(args):
+        write(json_dumpb({"results": list(items)}, pretty=True))
+        write(b"\n")
+    else:
+        # Frame the array by hand so each item is encoded as soon as it is decoded
+        write(b'{"results":[')
+        for i, item in enumerate(items):
+            if i:
+                write(b',')
+            write(json_dumpb(item))
+        write(b']}\n')
+
+def format_plain_text(command, data: Iterable[Any]):
+    # Collect every line first and emit them with a single write
+    rows = []
 
-def format_plain_text(command, data):
     if command == 'find-symbol':
         # data is list of symbol dicts
-        if not isinstance(data, list):
-            print(data)
-            return
         for sym in data:
-            name = sym.get('name_path', sym.get('name', 'unknown'))
-            kind = sym.get('kind', 'unknown')
+            name = sym.get('name_path') or sym.get('name') or 'unknown'
+            kind = sym.get('kind') or 'unknown'
             # location is usually flattened or in 'location' dict
             # The tool helper _sanitize_symbol_dict removes 'location' and promotes 'relative_path'
-            path = sym.get('relative_path', 'unknown')
-
-            # range?
-            start_line = "?"
-            if 'body_location' in sym:
-                start_line = sym['body_location'].get('start_line', '?')
-            elif 'selection_range' in sym:
-                start_line = sym['selection_range'].get('start', {}).get('line', '?')
-            elif 'range' in sym:
-                start_line = sym['range'].get('start', {}).get('line', '?')
+            path = sym.get('relative_path') or 'unknown'
 
-            print(f"{name} ({kind}) - {path}:{start_line}")
+            rows.append(f"{name} ({kind}) - {path}:{extract_line(sym)}")
 
     elif command == 'file-overview':
         # data is list of top-level symbols
-        if not isinstance(data, list):
-            print(data)
-            return
-        print(f"File Overview:")
+        rows.append("File Overview:")
         for sym in data:
-            name = sym.get('name_path', sym.get('name', 'unknown'))
-            kind = sym.get('kind', 'unknown')
-            print(f"  - {name} ({kind})")
+            name = sym.get('name_path') or sym.get('name') or 'unknown'
+            kind = sym.get('kind') or 'unknown'
+            rows.append(f"  - {name} ({kind})")
 
     elif command == 'references':
         # data is list of referencing symbols
-        if not isinstance(data, list):
-            print(data)
-            return
         for ref in data:
-            name = ref.get('name_path', ref.get('name', 'unknown'))
-            path = ref.get('relative_path', 'unknown')
-
-            line = "?"
-            if 'body_location' in ref:
-                line = ref['body_location'].get('start_line', '?')
-            elif 'selection_range' in ref:
-                line = ref['selection_range'].get('start', {}).get('line', '?')
-            elif 'range' in ref:
-                line = ref['range'].get('start', {}).get('line', '?')
-
-            print(f"Referenced by {name} in {path}:{line}")
+            name = ref.get('name_path') or ref.get('name') or 'unknown'
+            path = ref.get('relative_path') or 'unknown'
+
+            rows.append(f"Referenced by {name} in {path}:{extract_line(ref)}")
             if 'content_around_reference' in ref:
-                print(f"    Snippet: {ref['content_around_reference'].strip()}")
+                rows.append(f"    Snippet: {ref['content_around_reference'].strip()}")
+
+    if rows:
+        rows.append("")
+        sys.stdout.write("\n".join(rows))
 
-def main():
+def run_async(coro):
+    """Run ``coro`` to completion, on a uvloop event loop when uvloop is installed."""
+    import asyncio
+
+    try:
+        import uvloop
+    except ImportError:
+        # Optional (and unavailable on Windows); the default loop works, just slower
+        return asyncio.run(coro)
+
+    if sys.version_info >= (3, 11):
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            return runner.run(coro)
+    uvloop.install()
+    return asyncio.run(coro)
+
+def add_output_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default='text', help="Output format; jsonl prints one result per line")
+    parser.add_argument("--pretty", action=argparse.BooleanOptionalAction, default=None, help="Indent --format json output (default: only when stdout is a terminal)")
+
+@functools.lru_cache(maxsize=None)
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Serena MCP Client")
 
     # Server connection args
-    parser.add_argument("--server-url", default="http://localhost:8000/sse", help="URL for SSE transport (default: http://localhost:8000/sse)")
+    parser.add_argument("--server-url", default=DEFAULT_SERVER_URL, help=f"URL for SSE transport (default: {DEFAULT_SERVER_URL})")
     parser.add_argument("--server-command", help="Command to run the server (Stdio transport). If set, ignores --server-url.")
     parser.add_argument("--server-args", nargs="*", default=[], help="Arguments for the server command")
+    parser.add_argument("--daemon-socket", default=DEFAULT_DAEMON_SOCKET, help=f"Unix socket of the session daemon (default: {DEFAULT_DAEMON_SOCKET})")
+    parser.add_argument("--no-daemon", action="store_true", help="Always connect to the server directly, even if a daemon is running")
 
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     # Query subcommand group
     query_parser = subparsers.add_parser("query", help="Query the code")
+    query_parser.set_defaults(handler=run_query)
     query_subparsers = query_parser.add_subparsers(dest="subcommand", required=True)
 
     # find-symbol
     fs_parser = query_subparsers.add_parser("find-symbol", help="Find symbols")
-    fs_parser.add_argument("--name", required=True, help="Symbol name or pattern")
+    fs_parser.add_argument("--name", required=True, nargs="+", help="Symbol name or pattern (several may be given)")
     fs_parser.add_argument("--path", help="Relative path restriction")
     fs_parser.add_argument("--language", help="Language hint (ignored currently)")
     fs_parser.add_argument("--limit", type=int, help="Max results")
-    fs_parser.add_argument("--format", choices=['text', 'json'], default='text')
+    fs_parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY, help=f"Max tool calls in flight when several names are given (0 = unbounded, default: {DEFAULT_MAX_CONCURRENCY})")
+    add_output_args(fs_parser)
 
     # file-overview
     fo_parser = query_subparsers.add_parser("file-overview", help="Get file overview")
     fo_parser.add_argument("--path", required=True, help="Path to the file")
-    fo_parser.add_argument("--format", choices=['text', 'json'], default='text')
+    add_output_args(fo_parser)
 
     # references
     ref_parser = query_subparsers.add_parser("references", help="Find references")
     ref_parser.add_argument("--name", required=True, help="Symbol name")
     ref_parser.add_argument("--path", required=True, help="File path where symbol is defined")
-    ref_parser.add_argument("--format", choices=['text', 'json'], default='text')
-
-    args = parser.parse_args()
-
-    if args.command == 'query':
-        asyncio.run(run_query(args))
+    add_output_args(ref_parser)
+
+    # batch
+    batch_parser = query_subparsers.add_parser("batch", help="Run many queries over one session")
+    batch_parser.set_defaults(handler=run_batch)
+    batch_parser.add_argument("file", help='JSON array or JSON-Lines file of queries, e.g. {"subcommand": "find-symbol", "name": "Foo"} or {"tool": "find_symbol", "arguments": {...}} ("-" for stdin)')
+    batch_parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY, help=f"Max entries in flight at once (0 = unbounded, default: {DEFAULT_MAX_CONCURRENCY})")
+
+    # daemon
+    daemon_parser = subparsers.add_parser("daemon", help="Keep one server session alive and serve queries over a Unix socket")
+    daemon_parser.set_defaults(handler=run_daemon)
+    daemon_parser.add_argument("--idle-timeout", type=float, default=10, help="Exit after this many idle minutes (0 disables, default: 10)")
+    daemon_parser.add_argument("--keepalive", type=float, default=30, help="Ping the server every this many seconds (0 disables, default: 30)")
+    daemon_parser.add_argument("server", nargs=argparse.REMAINDER, metavar="-- COMMAND ARGS",
+                               help="Server command line to run over stdio, taken verbatim (overrides --server-command/--server-args)")
+
+    return parser
+
+# Query shapes fast_parse understands: (required options, optional options)
+FAST_PATH_SHAPES = {
+    'find-symbol': (('--name',), ('--path', '--format')),
+    'file-overview': (('--path',), ('--format',)),
+    'references': (('--name', '--path'), ('--format',)),
+}
+
+def fast_parse(argv: List[str]) -> Optional[argparse.Namespace]:
+    """Parse the plain `query <subcommand> --opt value ...` shapes without building the parser.
+
+    Returns None for anything else (global options, --help, other flags, a single
+    option given twice), in which case the full argparse parser takes over.
+    """
+    if len(argv) < 4 or argv[0] != 'query' or argv[1] not in FAST_PATH_SHAPES:
+        return None
+    subcommand = argv[1]
+    required, optional = FAST_PATH_SHAPES[subcommand]
+
+    options = argv[2:]
+    if len(options) % 2:
+        return None
+    values = {}
+    for flag, value in zip(options[::2], options[1::2]):
+        if flag in values or (flag not in required and flag not in optional) or value.startswith('-'):
+            return None
+        values[flag] = value
+    if any(flag not in values for flag in required):
+        return None
+    output_format = values.get('--format', 'text')
+    if output_format not in OUTPUT_FORMATS:
+        return None
+
+    # Mirror exactly what build_parser().parse_args() would produce
+    args = argparse.Namespace(
+        server_url=DEFAULT_SERVER_URL,
+        server_command=None,
+        server_args=[],
+        daemon_socket=DEFAULT_DAEMON_SOCKET,
+        no_daemon=False,
+        command='query',
+        handler=run_query,
+        subcommand=subcommand,
+        path=values.get('--path'),
+        format=output_format,
+        pretty=None,
+    )
+    if subcommand == 'find-symbol':
+        args.name = [values['--name']]
+        args.language = None
+        args.limit = None
+        args.max_concurrency = DEFAULT_MAX_CONCURRENCY
+    elif subcommand == 'references':
+        args.name = values['--name']
+    return args
+
+def main(argv: Optional[List[str]] = None) -> int:
+    if argv is None:
+        argv = sys.argv[1:]
+    args = fast_parse(argv)
+    if args is None:
+        args = build_parser().parse_args(argv)
+
+    # Each (sub)parser registers its coroutine as the `handler` default
+    return run_async(args.handler(args))
+
+def exit_now(code: int):
+    """Exit without interpreter teardown once the command has finished.
+
+    The handler has already closed its session, so module finalization and
+    garbage collection at shutdown are pure overhead. Only safe from the
+    script entry point, never from code that imported ``main``.
+    """
+    try:
+        sys.stdout.flush()
+    except BrokenPipeError:
+        code = code or 1
+    sys.stderr.flush()
+    os._exit(code)
 
 if __name__ == "__main__":
-    main()
+    exit_now(main())